@@ -1,9 +1,13 @@
 import atexit
-import struct
+import logging
 import threading
-from typing import Optional
+from collections import OrderedDict
+from concurrent.futures import Future
+from typing import Dict, Optional, Tuple
 from pwrpy.models.MerkleTree import MerkleTree
 
+logger = logging.getLogger("vida")
+
 class DatabaseServiceError(Exception):
     """Custom exception for DatabaseService operations"""
     pass
@@ -12,9 +16,35 @@ class DatabaseServiceError(Exception):
 _tree = None
 _lock = threading.Lock()
 
+# In-memory cache of the last checked block number; the generation counter guards against caching a stale read
+_last_checked_block_cache: Optional[int] = None
+_lcb_generation = 0
+_lcb_lock = threading.Lock()
+
+# LRU cache of historical block root hashes as (bytes, hex) pairs, keyed by block number;
+# the generation counter guards against caching a read that a write or revert made stale
+_block_root_cache: "OrderedDict[int, Tuple[bytes, str]]" = OrderedDict()
+_block_root_generation = 0
+_block_root_lock = threading.Lock()
+
+# Serialize current-root cache misses so concurrent readers share one tree read instead of each doing their own
+_root_fill_lock = threading.Lock()
+
+# In-flight block root reads, keyed by block number, so concurrent misses for the same block share
+# one tree read while misses for different blocks proceed in parallel
+_block_root_fills: Dict[int, "Future[Optional[Tuple[bytes, str]]]"] = {}
+
+# Memoized current root hash as a (bytes, hex) pair; the generation counter guards against caching a stale read
+_current_root_cache: Optional[Tuple[bytes, str]] = None
+_root_generation = 0
+_root_lock = threading.Lock()
+
 # Constants
 LAST_CHECKED_BLOCK_KEY = b"lastCheckedBlock"
 BLOCK_ROOT_PREFIX = "blockRootHash_"
+BLOCK_ROOT_KEY_TEMPLATE = BLOCK_ROOT_PREFIX.encode('ascii') + b"%d"
+BLOCK_ROOT_CACHE_SIZE = 4096
+ZERO_BALANCE_BYTES = b'\x00'
 
 def _get_tree():
     """Get or create the global MerkleTree instance"""
@@ -29,6 +59,118 @@ def _get_tree():
                     raise DatabaseServiceError(f"Failed to initialize MerkleTree: {str(e)}")
     return _tree
 
+def _invalidate_root_cache():
+    """Drop the memoized root hash after the tree has been mutated"""
+    global _current_root_cache, _root_generation
+    with _root_lock:
+        _root_generation += 1
+        _current_root_cache = None
+
+def _put(tree, key: bytes, value: bytes):
+    """Write a key to the tree and invalidate the memoized root hash"""
+    try:
+        tree.add_or_update_data(key, value)
+    finally:
+        _invalidate_root_cache()
+
+def _block_root_key(block_number: int) -> bytes:
+    """Build the tree key under which a block's root hash is stored"""
+    return BLOCK_ROOT_KEY_TEMPLATE % block_number
+
+def _cache_block_root_hash(block_number: int, root_hash: bytes, generation: Optional[int] = None) -> Tuple[bytes, str]:
+    """Insert a block root hash into the LRU cache, evicting the oldest entry if full.
+
+    Fills pass the generation they read under and are skipped if it has moved on; writes pass
+    none and bump it, so a fill racing the write cannot overwrite the new value.
+    """
+    global _block_root_generation
+    entry = (root_hash, root_hash.hex())
+    with _block_root_lock:
+        if generation is None:
+            _block_root_generation += 1
+        elif generation != _block_root_generation:
+            return entry
+        _block_root_cache[block_number] = entry
+        _block_root_cache.move_to_end(block_number)
+        if len(_block_root_cache) > BLOCK_ROOT_CACHE_SIZE:
+            _block_root_cache.popitem(last=False)
+    return entry
+
+def _current_root_entry() -> Optional[Tuple[bytes, str]]:
+    """Get the current root hash and its hex form, memoized until the next write"""
+    global _current_root_cache
+    cached = _current_root_cache
+    if cached is not None:
+        return cached
+    
+    with _root_fill_lock:
+        cached = _current_root_cache
+        if cached is not None:
+            return cached
+        
+        generation = _root_generation
+        root_hash = _get_tree().get_root_hash()
+        if root_hash is None:
+            return None
+        
+        entry = (root_hash, root_hash.hex())
+        with _root_lock:
+            if generation == _root_generation:
+                _current_root_cache = entry
+        return entry
+
+def _block_root_entry(block_number: int) -> Optional[Tuple[bytes, str]]:
+    """Get a block's root hash and its hex form, through the LRU cache"""
+    with _block_root_lock:
+        cached = _block_root_cache.get(block_number)
+        if cached is not None:
+            _block_root_cache.move_to_end(block_number)
+            return cached
+        
+        fill = _block_root_fills.get(block_number)
+        if fill is not None:
+            leader = False
+        else:
+            fill = Future()
+            _block_root_fills[block_number] = fill
+            generation = _block_root_generation
+            leader = True
+    
+    if not leader:
+        return fill.result()
+    
+    try:
+        root_hash = _get_tree().get_data(_block_root_key(block_number))
+        entry = None
+        if root_hash is not None:
+            entry = _cache_block_root_hash(block_number, root_hash, generation)
+        fill.set_result(entry)
+        return entry
+    except BaseException as e:
+        fill.set_exception(e)
+        raise
+    finally:
+        with _block_root_lock:
+            _block_root_fills.pop(block_number, None)
+
+def _encode_balance(balance: int) -> bytes:
+    """Encode a balance as minimal big-endian bytes"""
+    if balance == 0:
+        return ZERO_BALANCE_BYTES
+    return balance.to_bytes((balance.bit_length() + 7) // 8, byteorder='big', signed=False)
+
+def _decode_balance(data: Optional[bytes]) -> int:
+    """Decode a stored balance, treating missing data as zero"""
+    if data is None or len(data) == 0:
+        return 0
+    return int.from_bytes(data, byteorder='big', signed=False)
+
+def _batch_set_balances(tree, updates):
+    """Encode all balances up front and write them to the tree back to back"""
+    encoded = [(address, _encode_balance(balance)) for address, balance in updates]
+    for address, balance_bytes in encoded:
+        _put(tree, address, balance_bytes)
+
 def _shutdown_hook():
     """Cleanup method called on application shutdown"""
     global _tree
@@ -36,17 +178,30 @@ def _shutdown_hook():
         if _tree is not None:
             _tree.close()
     except Exception as e:
-        print(f"Error during DatabaseService shutdown: {e}")
+        logger.error("Error during DatabaseService shutdown: %s", e)
 
 class DatabaseService:
-    """Database service class providing methods for Merkle tree operations"""
+    """Database service class providing methods for Merkle tree operations.
+
+    Writes are staged in the MerkleTree's in-memory cache and only reach disk on
+    flush(); revert_unsaved_changes() discards everything staged since then.
+    """
     
     @staticmethod
     def get_root_hash() -> Optional[bytes]:
         """Get current Merkle root hash"""
         try:
-            tree = _get_tree()
-            return tree.get_root_hash()
+            entry = _current_root_entry()
+            return entry[0] if entry is not None else None
+        except Exception as e:
+            raise DatabaseServiceError(f"Error getting root hash: {str(e)}")
+
+    @staticmethod
+    def get_root_hash_hex() -> Optional[str]:
+        """Get current Merkle root hash as a hex string"""
+        try:
+            entry = _current_root_entry()
+            return entry[1] if entry is not None else None
         except Exception as e:
             raise DatabaseServiceError(f"Error getting root hash: {str(e)}")
 
@@ -62,9 +217,19 @@ class DatabaseService:
     @staticmethod
     def revert_unsaved_changes():
         """Reverts all unsaved changes to the Merkle tree"""
+        global _last_checked_block_cache, _lcb_generation, _block_root_generation
         try:
             tree = _get_tree()
-            tree.revert_unsaved_changes()
+            try:
+                tree.revert_unsaved_changes()
+            finally:
+                _invalidate_root_cache()
+            with _lcb_lock:
+                _lcb_generation += 1
+                _last_checked_block_cache = None
+            with _block_root_lock:
+                _block_root_generation += 1
+                _block_root_cache.clear()
         except Exception as e:
             raise DatabaseServiceError(f"Error reverting changes: {str(e)}")
 
@@ -76,12 +241,7 @@ class DatabaseService:
         
         try:
             tree = _get_tree()
-            data = tree.get_data(address)
-            
-            if data is None or len(data) == 0:
-                return 0
-            
-            return int.from_bytes(data, byteorder='big', signed=False)
+            return _decode_balance(tree.get_data(address))
             
         except Exception as e:
             raise DatabaseServiceError(f"Error getting balance: {str(e)}")
@@ -98,15 +258,30 @@ class DatabaseService:
         
         try:
             tree = _get_tree()
-            balance_bytes = balance.to_bytes((balance.bit_length() + 7) // 8, byteorder='big', signed=False)
-            if balance == 0:
-                balance_bytes = b'\x00'
-            
-            tree.add_or_update_data(address, balance_bytes)
+            _put(tree, address, _encode_balance(balance))
             
         except Exception as e:
             raise DatabaseServiceError(f"Error setting balance: {str(e)}")
 
+    @staticmethod
+    def set_balances_bulk(balances):
+        """Sets the balances for several addresses in one pass"""
+        updates = list(balances)
+        for address, balance in updates:
+            if address is None:
+                raise ValueError("Address must not be null")
+            if balance is None:
+                raise ValueError("Balance must not be null")
+            if balance < 0:
+                raise ValueError("Balance must be non-negative")
+        
+        try:
+            tree = _get_tree()
+            _batch_set_balances(tree, updates)
+            
+        except Exception as e:
+            raise DatabaseServiceError(f"Error setting balances: {str(e)}")
+
     @staticmethod
     def transfer(sender: bytes, receiver: bytes, amount: int) -> bool:
         """Transfers amount from sender to receiver"""
@@ -118,13 +293,20 @@ class DatabaseService:
             raise ValueError("Amount must not be null")
         
         try:
-            sender_balance = DatabaseService.get_balance(sender)
+            tree = _get_tree()
+            sender_balance = _decode_balance(tree.get_data(sender))
             if sender_balance < amount:
                 return False
             
-            DatabaseService.set_balance(sender, sender_balance - amount)
-            receiver_balance = DatabaseService.get_balance(receiver)
-            DatabaseService.set_balance(receiver, receiver_balance + amount)
+            # A self-transfer leaves the balance unchanged
+            if sender == receiver:
+                return True
+            
+            receiver_balance = _decode_balance(tree.get_data(receiver))
+            _batch_set_balances(tree, [
+                (sender, sender_balance - amount),
+                (receiver, receiver_balance + amount),
+            ])
             
             return True
             
@@ -134,14 +316,26 @@ class DatabaseService:
     @staticmethod
     def get_last_checked_block() -> int:
         """Get the last checked block number"""
+        global _last_checked_block_cache
+        cached = _last_checked_block_cache
+        if cached is not None:
+            return cached
+        
         try:
+            generation = _lcb_generation
             tree = _get_tree()
             data = tree.get_data(LAST_CHECKED_BLOCK_KEY)
             
             if data is None or len(data) < 8:
-                return 0
+                block_number = 0
+            else:
+                block_number = int.from_bytes(data[:8], byteorder='big', signed=False)
             
-            return struct.unpack('>Q', data)[0]
+            with _lcb_lock:
+                # A concurrent set or revert makes this read stale; leave the cache to the writer
+                if generation == _lcb_generation:
+                    _last_checked_block_cache = block_number
+            return block_number
             
         except Exception as e:
             raise DatabaseServiceError(f"Error getting last checked block: {str(e)}")
@@ -149,13 +343,18 @@ class DatabaseService:
     @staticmethod
     def set_last_checked_block(block_number: int):
         """Updates the last checked block number"""
+        global _last_checked_block_cache, _lcb_generation
         if block_number < 0:
             raise ValueError("Block number must be non-negative")
         
         try:
             tree = _get_tree()
-            data = struct.pack('>Q', block_number)
-            tree.add_or_update_data(LAST_CHECKED_BLOCK_KEY, data)
+            data = block_number.to_bytes(8, byteorder='big', signed=False)
+            _put(tree, LAST_CHECKED_BLOCK_KEY, data)
+            # Bump after the write so any fill that could have read the old value is discarded
+            with _lcb_lock:
+                _lcb_generation += 1
+                _last_checked_block_cache = block_number
             
         except Exception as e:
             raise DatabaseServiceError(f"Error setting last checked block: {str(e)}")
@@ -168,8 +367,8 @@ class DatabaseService:
         
         try:
             tree = _get_tree()
-            key = f"{BLOCK_ROOT_PREFIX}{block_number}"
-            tree.add_or_update_data(key.encode('utf-8'), root_hash)
+            _put(tree, _block_root_key(block_number), root_hash)
+            _cache_block_root_hash(block_number, root_hash)
             
         except Exception as e:
             raise DatabaseServiceError(f"Error setting block root hash: {str(e)}")
@@ -178,9 +377,18 @@ class DatabaseService:
     def get_block_root_hash(block_number: int) -> Optional[bytes]:
         """Retrieves the Merkle root hash for a specific block"""
         try:
-            tree = _get_tree()
-            key = f"{BLOCK_ROOT_PREFIX}{block_number}"
-            return tree.get_data(key.encode('utf-8'))
+            entry = _block_root_entry(block_number)
+            return entry[0] if entry is not None else None
+            
+        except Exception as e:
+            raise DatabaseServiceError(f"Error getting block root hash: {str(e)}")
+
+    @staticmethod
+    def get_block_root_hash_hex(block_number: int) -> Optional[str]:
+        """Retrieves the Merkle root hash for a specific block as a hex string"""
+        try:
+            entry = _block_root_entry(block_number)
+            return entry[1] if entry is not None else None
             
         except Exception as e:
             raise DatabaseServiceError(f"Error getting block root hash: {str(e)}")
@@ -1,76 +1,221 @@
+import atexit
+import binascii
+import functools
 import json
+import logging
+import threading
+import time
+from collections import OrderedDict
 import requests
+from requests.adapters import HTTPAdapter
+from concurrent.futures import ThreadPoolExecutor, as_completed, TimeoutError as FuturesTimeoutError
 from pwrpy.pwrsdk import PWRPY
 from database_service import DatabaseService
 
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
+logger = logging.getLogger("vida")
+
 VIDA_ID = 73_746_238
 RPC_URL = "https://pwrrpc.pwrlabs.io/"
 REQUEST_TIMEOUT = 10
+MIN_PEER_WORKERS = 8
+PEER_REQUEST_HEADERS = {'Accept': 'text/plain'}
+FLUSH_EVERY = 32
+FLUSH_INTERVAL = 1.0
+ORJSON_MAX_DEPTH = 64
+
+PEER_POOL_MAXSIZE = 64
+PEER_ROOT_CACHE_SIZE = 16384
+PEER_ROOT_CACHE_TTL = 300
+
+# Shared HTTP session so peer connections are kept alive across blocks
+_session = requests.Session()
+_session.mount('http://', HTTPAdapter(pool_connections=32, pool_maxsize=PEER_POOL_MAXSIZE, max_retries=0))
 
 pwrpy_client = None
 subscription = None
 peers_to_check_root_hash_with = []
+self_peer_addresses = set()
+_peer_pool = None
+_peer_pool_size = 0
+_pending_flush_count = 0
+_last_flush = time.monotonic()
+_flush_lock = threading.Lock()
+# Set while a block's writes are being applied, so the tree is not at a block boundary
+_in_block = False
+_peer_url_prefixes = {}
+_peer_root_cache = OrderedDict()
+_peer_root_cache_lock = threading.Lock()
+
+# Returns the shared thread pool used to query peers, growing it if the peer list outgrew it
+def _get_peer_pool(peers_count):
+    global _peer_pool, _peer_pool_size
+    workers = max(MIN_PEER_WORKERS, peers_count)
+    if _peer_pool is None or _peer_pool_size < workers:
+        old_pool = _peer_pool
+        _peer_pool = ThreadPoolExecutor(max_workers=workers, thread_name_prefix="peer-fetch")
+        _peer_pool_size = workers
+        if old_pool is not None:
+            old_pool.shutdown(wait=False)
+        if workers > PEER_POOL_MAXSIZE:
+            # Keep one pooled connection per worker so concurrent fetches are not discarded
+            _session.mount('http://', HTTPAdapter(pool_connections=32, pool_maxsize=workers, max_retries=0))
+    return _peer_pool
+
+# Returns the cached "/rootHash" URL prefix for a peer, building it on first use
+def _peer_url_prefix(peer):
+    prefix = _peer_url_prefixes.get(peer)
+    if prefix is None:
+        prefix = f"http://{peer}/rootHash?blockNumber="
+        _peer_url_prefixes[peer] = prefix
+    return prefix
 
-# Fetches the root hash from a peer node for the specified block number
-def fetch_peer_root_hash(peer, block_number):
-    url = f"http://{peer}/rootHash?blockNumber={block_number}"
+# Returns a peer's recently fetched root hash for a block, if still fresh
+def _get_cached_peer_root(peer, block_number):
+    key = (peer, block_number)
+    with _peer_root_cache_lock:
+        entry = _peer_root_cache.get(key)
+        if entry is None:
+            return None
+        fetched_at, root_hash = entry
+        if time.monotonic() - fetched_at > PEER_ROOT_CACHE_TTL:
+            del _peer_root_cache[key]
+            return None
+        _peer_root_cache.move_to_end(key)
+        return root_hash
+
+# Remembers a peer root hash that agreed with ours, evicting the oldest entry if full
+def _cache_peer_root(peer, block_number, root_hash):
+    with _peer_root_cache_lock:
+        _peer_root_cache[(peer, block_number)] = (time.monotonic(), root_hash)
+        _peer_root_cache.move_to_end((peer, block_number))
+        if len(_peer_root_cache) > PEER_ROOT_CACHE_SIZE:
+            _peer_root_cache.popitem(last=False)
+
+# Fetches the root hash from a peer node for the specified block number;
+# answers that agree with local_root are cached so re-validating a block does not re-query the peer
+def fetch_peer_root_hash(peer, block_number, local_root=None):
+    # Our own API would just serve the local root back, so skip the round trip; answer with
+    # the snapshot being validated rather than whatever root is current when this thread runs
+    if peer in self_peer_addresses:
+        return True, local_root
+    
+    cached = _get_cached_peer_root(peer, block_number)
+    if cached is not None:
+        return True, cached
+    
+    success, root_hash = _request_peer_root_hash(peer, block_number)
+    # A disagreeing answer may be transient (e.g. a peer serving an in-flight root), so it is
+    # never cached; a replay of the block must ask the peer again
+    if success and root_hash and root_hash == local_root:
+        _cache_peer_root(peer, block_number, root_hash)
+    return success, root_hash
+
+# Requests the root hash for a block from a peer over HTTP
+def _request_peer_root_hash(peer, block_number):
+    url = _peer_url_prefix(peer) + str(block_number)
         
     try:
-        response = requests.get(url, timeout=REQUEST_TIMEOUT, headers={'Accept': 'text/plain'})
+        response = _session.get(url, timeout=REQUEST_TIMEOUT, headers=PEER_REQUEST_HEADERS)
         
         if response.status_code == 200:
-            hex_string = response.text.strip()
+            # Decode the raw body directly; skips requests' text decoding of the payload
+            hex_string = response.content.strip()
             
             if not hex_string:
-                print(f"Peer {peer} returned empty root hash for block {block_number}")
+                logger.warning("Peer %s returned empty root hash for block %s", peer, block_number)
                 return False, None
             
             try:
-                root_hash = bytes.fromhex(hex_string)
-                print(f"Successfully fetched root hash from peer {peer} for block {block_number}")
+                root_hash = binascii.a2b_hex(hex_string)
+                logger.debug("Successfully fetched root hash from peer %s for block %s", peer, block_number)
                 return True, root_hash
             except ValueError:
-                print(f"Invalid hex response from peer {peer} for block {block_number}")
+                logger.warning("Invalid hex response from peer %s for block %s", peer, block_number)
                 return False, None
         else:
-            print(f"Peer {peer} returned HTTP {response.status_code} for block {block_number}")
+            logger.warning("Peer %s returned HTTP %s for block %s", peer, response.status_code, block_number)
             return True, None
             
     except Exception:
-        print(f"Failed to fetch root hash from peer {peer} for block {block_number}")
+        logger.warning("Failed to fetch root hash from peer %s for block %s", peer, block_number)
         return False, None
 
-# Validates the local Merkle root against peers and persists it if a quorum of peers agree
-def check_root_hash_validity_and_save(block_number):
-    local_root = DatabaseService.get_root_hash()
+# Validates the local Merkle root against peers and persists it if a quorum of peers agree;
+# returns False if the block's writes were reverted instead
+def check_root_hash_validity_and_save(block_number, local_root=None):
+    if local_root is None:
+        local_root = DatabaseService.get_root_hash()
     
     if not local_root:
-        print(f"No local root hash available for block {block_number}")
-        return
+        logger.warning("No local root hash available for block %s", block_number)
+        return True
+    
+    peers_snapshot = tuple(peers_to_check_root_hash_with)
+    
+    # With no external peers there is nobody to ask; the local root is the only vote
+    if all(peer in self_peer_addresses for peer in peers_snapshot):
+        DatabaseService.set_block_root_hash(block_number, local_root)
+        logger.info("Root hash saved for block %s (no external peers)", block_number)
+        return True
     
-    peers_count = len(peers_to_check_root_hash_with)
-    quorum = (peers_count * 2) // 3 + 1
+    peers_count = len(peers_snapshot)
+    # Quorum required for each possible number of responsive peers
+    thresholds = [(n * 2) // 3 + 1 for n in range(peers_count + 1)]
+    remaining = peers_count
+    outstanding = peers_count
     matches = 0
     
-    for peer in peers_to_check_root_hash_with:
-        success, root_hash = fetch_peer_root_hash(peer, block_number)
-        
-        if success and root_hash:
-            if root_hash == local_root:
-                matches += 1
-        else:
-            if peers_count > 0:
-                peers_count -= 1
-                quorum = (peers_count * 2) // 3 + 1
-        
-        if matches >= quorum:
-            DatabaseService.set_block_root_hash(block_number, local_root)
-            print(f"Root hash validated and saved for block {block_number}")
-            return
+    pool = _get_peer_pool(peers_count)
+    futures = [pool.submit(fetch_peer_root_hash, peer, block_number, local_root) for peer in peers_snapshot]
     
-    print(f"Root hash mismatch: only {matches}/{len(peers_to_check_root_hash_with)} peers agreed")
-    DatabaseService.revert_unsaved_changes()
+    try:
+        for future in as_completed(futures, timeout=REQUEST_TIMEOUT + 1):
+            success, root_hash = future.result()
+            outstanding -= 1
+            
+            if success and root_hash:
+                if root_hash == local_root:
+                    matches += 1
+            else:
+                remaining -= 1
+            
+            if matches >= thresholds[remaining]:
+                for pending in futures:
+                    pending.cancel()
+                DatabaseService.set_block_root_hash(block_number, local_root)
+                logger.info("Root hash validated and saved for block %s", block_number)
+                return True
+            
+            # Even if every outstanding peer agrees, quorum can no longer be reached
+            if matches + outstanding < thresholds[remaining]:
+                for pending in futures:
+                    pending.cancel()
+                break
+    except FuturesTimeoutError:
+        logger.warning("Timed out waiting for peer root hashes for block %s", block_number)
+        for pending in futures:
+            pending.cancel()
+        # Peers that never answered count as unresponsive and drop out of the quorum
+        remaining -= outstanding
+        if matches >= thresholds[remaining]:
+            DatabaseService.set_block_root_hash(block_number, local_root)
+            logger.info("Root hash validated and saved for block %s", block_number)
+            return True
+
+    logger.warning("Root hash mismatch: only %s/%s peers agreed", matches, len(peers_snapshot))
+    _revert_pending_blocks()
     subscription.set_latest_checked_block(DatabaseService.get_last_checked_block())
+    return False
+
+# Decodes a hex address with an optional 0x prefix; cached since senders repeat across transactions
+@functools.lru_cache(maxsize=4096)
+def decode_hex_address(hex_str):
+    return bytes.fromhex(hex_str.removeprefix('0x'))
 
 # Executes a token transfer described by the given JSON payload
 def handle_transfer(json_data, sender_hex):
@@ -79,57 +224,151 @@ def handle_transfer(json_data, sender_hex):
         receiver_hex = json_data.get('receiver', '')
         
         if amount <= 0 or not receiver_hex:
-            print(f"Invalid transfer data: {json_data}")
+            logger.warning("Invalid transfer data: %s", json_data)
             return
 
-        sender_address = sender_hex[2:] if sender_hex.startswith('0x') else sender_hex
-        receiver_address = receiver_hex[2:] if receiver_hex.startswith('0x') else receiver_hex
-
-        sender = bytes.fromhex(sender_address)
-        receiver = bytes.fromhex(receiver_address)
+        sender = decode_hex_address(sender_hex)
+        receiver = decode_hex_address(receiver_hex)
         
         success = DatabaseService.transfer(sender, receiver, amount)
         
         if success:
-            print(f"Transfer succeeded: {amount} from {sender_hex} to {receiver_hex}")
+            logger.debug("Transfer succeeded: %s from %s to %s", amount, sender_hex, receiver_hex)
         else:
-            print(f"Transfer failed (insufficient funds): {amount} from {sender_hex} to {receiver_hex}")
+            logger.debug("Transfer failed (insufficient funds): %s from %s to %s", amount, sender_hex, receiver_hex)
             
     except Exception as e:
-        print(f"Error handling transfer: {e}")
+        logger.error("Error handling transfer: %s", e)
+
+# Handlers for each supported transaction action, keyed by lowercase action name
+ACTION_HANDLERS = {
+    'transfer': handle_transfer,
+}
+
+# Returns True if orjson's result may differ from json.loads: it holds a float anywhere, or
+# nests deeper than ORJSON_MAX_DEPTH (json.loads raises RecursionError on very deep input,
+# so those payloads must be left to it). Walks an explicit stack, never recursing itself.
+def _needs_stdlib_parse(value):
+    stack = [(value, 0)]
+    while stack:
+        item, depth = stack.pop()
+        if isinstance(item, float):
+            return True
+        if isinstance(item, (dict, list)):
+            if depth >= ORJSON_MAX_DEPTH:
+                return True
+            children = item.values() if isinstance(item, dict) else item
+            stack.extend((child, depth + 1) for child in children)
+    return False
+
+# Parses a UTF-8 JSON payload, preferring orjson when it is installed
+def _parse_json(data_bytes):
+    # Decode strictly first: json.loads on raw bytes would also sniff UTF-16/UTF-32 and
+    # skip a BOM, accepting payloads the other nodes reject
+    data_str = data_bytes.decode('utf-8')
+    if orjson is not None:
+        try:
+            parsed = orjson.loads(data_str)
+            # orjson turns integers beyond 64 bits into floats, so only trust float-free,
+            # shallow results
+            if not _needs_stdlib_parse(parsed):
+                return parsed
+        except orjson.JSONDecodeError:
+            # orjson rejects some documents json.loads accepts (NaN, lone surrogates);
+            # fall back so the accepted set stays exactly that of json.loads on the str
+            pass
+    return json.loads(data_str)
 
 # Processes a single VIDA transaction
 def process_transaction(txn):
+    _enter_block()
     try:
         data_hex = txn.data
         data_bytes = bytes.fromhex(data_hex)
         
-        data_str = data_bytes.decode('utf-8')
-        json_data = json.loads(data_str)
+        json_data = _parse_json(data_bytes)
         
-        action = json_data.get('action', '')
+        action = json_data.get('action')
         
-        if action.lower() == 'transfer':
-            handle_transfer(json_data, txn.sender)
+        if action:
+            action_handler = ACTION_HANDLERS.get(action.lower())
+            if action_handler is not None:
+                action_handler(json_data, txn.sender)
             
     except Exception as e:
-        print(f"Error processing transaction: {e}")
+        logger.error("Error processing transaction: %s", e)
+
+# Marks the tree as mid-block before the first write of a block
+def _enter_block():
+    global _in_block
+    if not _in_block:
+        with _flush_lock:
+            _in_block = True
+
+# Discards every write since the last flush, including blocks checkpointed but not yet flushed
+def _revert_pending_blocks():
+    global _pending_flush_count, _last_flush
+    with _flush_lock:
+        DatabaseService.revert_unsaved_changes()
+        _pending_flush_count = 0
+        _last_flush = time.monotonic()
+
+# Flushes pending blocks to disk; the caller must hold _flush_lock
+def _flush_pending_locked():
+    global _pending_flush_count, _last_flush
+    if _pending_flush_count == 0:
+        return
+    DatabaseService.flush()
+    _pending_flush_count = 0
+    _last_flush = time.monotonic()
+
+# Flushes checkpointed blocks to disk if any are still pending
+def flush_pending_blocks():
+    with _flush_lock:
+        _flush_pending_locked()
 
-# Callback invoked as blocks are processed
+# Exit hook: persists completed blocks, but never a block that is only partly applied
+def _flush_on_exit():
+    global _pending_flush_count
+    with _flush_lock:
+        if _in_block:
+            logger.warning("Exiting mid-block; discarding writes since the last flush")
+            DatabaseService.revert_unsaved_changes()
+            _pending_flush_count = 0
+            return
+        _flush_pending_locked()
+
+# Callback invoked as blocks are processed; flushes every FLUSH_EVERY blocks or FLUSH_INTERVAL seconds
 def on_chain_progress(block_number):
+    global _pending_flush_count, _in_block
+    _enter_block()
     DatabaseService.set_last_checked_block(block_number)
-    check_root_hash_validity_and_save(block_number)
-    print(f"Checkpoint updated to block {block_number}")
-    DatabaseService.flush()
+    # Snapshot the root the block produced, so validation compares exactly this state
+    local_root = DatabaseService.get_root_hash()
+    kept = check_root_hash_validity_and_save(block_number, local_root)
+    logger.info("Checkpoint updated to block %s", block_number)
+    
+    with _flush_lock:
+        _in_block = False
+        if not kept:
+            return
+        _pending_flush_count += 1
+        due = (_pending_flush_count >= FLUSH_EVERY
+               or time.monotonic() - _last_flush > FLUSH_INTERVAL)
+    if due:
+        flush_pending_blocks()
 
 # Subscribes to VIDA transactions starting from the given block
 def subscribe_and_sync(from_block):
     global pwrpy_client, subscription
     
-    print(f"Starting VIDA transaction subscription from block {from_block}")
+    logger.info("Starting VIDA transaction subscription from block %s", from_block)
     
     pwrpy_client = PWRPY(RPC_URL)
     
+    # Registered after the database is opened so it runs before the tree is closed
+    atexit.register(_flush_on_exit)
+    
     subscription = pwrpy_client.subscribe_to_vida_transactions(
         VIDA_ID,
         from_block,
@@ -137,4 +376,10 @@ def subscribe_and_sync(from_block):
         on_chain_progress
     )
     
-    print(f"Successfully subscribed to VIDA {VIDA_ID} transactions")
+    logger.info("Successfully subscribed to VIDA %s transactions", VIDA_ID)
+
+# Stops the VIDA transaction subscription so the process can exit cleanly
+def stop_sync():
+    if subscription is not None:
+        subscription.stop()
+        logger.info("Stopped VIDA %s transaction subscription", VIDA_ID)
@@ -1,71 +1,127 @@
+import atexit
+import logging
+import os
+import queue
+import signal
 import sys
 import threading
-import time
+from logging.handlers import QueueHandler, QueueListener
+from types import MappingProxyType
+from werkzeug.serving import make_server
 from database_service import DatabaseService
 from api.get import app as api_app
-from handler import subscribe_and_sync, peers_to_check_root_hash_with
+from handler import subscribe_and_sync, stop_sync, peers_to_check_root_hash_with, self_peer_addresses
+
+try:
+    from waitress import create_server as waitress_create_server
+except ImportError:
+    waitress_create_server = None
 
 START_BLOCK = 1
 PORT = 8080
+API_STARTUP_TIMEOUT = 5.0
+API_THREADS = 16
+API_CONNECTION_LIMIT = 256
 
-INITIAL_BALANCES = {
+INITIAL_BALANCES = MappingProxyType({
     bytes.fromhex("c767ea1d613eefe0ce1610b18cb047881bafb829"): 1_000_000_000_000,
     bytes.fromhex("3b4412f57828d1ceb0dbf0d460f7eb1f21fed8b4"): 1_000_000_000_000,
     bytes.fromhex("9282d39ca205806473f4fde5bac48ca6dfb9d300"): 1_000_000_000_000,
     bytes.fromhex("e68191b7913e72e6f1759531fbfaa089ff02308a"): 1_000_000_000_000,
-}
+})
+
+api_server = None
+api_server_ready = threading.Event()
+shutdown_event = threading.Event()
+
+logger = logging.getLogger("vida")
 
-flask_thread = None
+# Routes log records through a queue so formatting and console writes happen off the hot path
+def configure_logging():
+    log_queue = queue.Queue(-1)
+    stream_handler = logging.StreamHandler()
+    stream_handler.setFormatter(logging.Formatter("%(message)s"))
+    listener = QueueListener(log_queue, stream_handler)
+    
+    logging.getLogger().addHandler(QueueHandler(log_queue))
+    logger.setLevel(os.environ.get("LOG_LEVEL", "INFO").upper())
+    
+    # Disable per-request logging from the API server
+    logging.getLogger('werkzeug').setLevel(logging.ERROR)
+    logging.getLogger('waitress').setLevel(logging.ERROR)
+    api_app.logger.setLevel(logging.ERROR)
+    
+    listener.start()
+    atexit.register(listener.stop)
 
 # Initializes peer list from arguments or defaults
 def initialize_peers():
+    self_peer_addresses.clear()
+    self_peer_addresses.update({f"localhost:{PORT}", f"127.0.0.1:{PORT}", f"0.0.0.0:{PORT}"})
+    
     if len(sys.argv) > 1:
         peers_to_check_root_hash_with.clear()
         peers_to_check_root_hash_with.extend(sys.argv[1:])
-        print(f"Using peers from args: {peers_to_check_root_hash_with}")
+        logger.info("Using peers from args: %s", peers_to_check_root_hash_with)
     else:
         peers_to_check_root_hash_with.clear()
         peers_to_check_root_hash_with.extend([
             "localhost:8080"
         ])
-        print(f"Using default peers: {peers_to_check_root_hash_with}")
+        logger.info("Using default peers: %s", peers_to_check_root_hash_with)
 
 # Sets up the initial account balances when starting from a fresh database
 def init_initial_balances():
     if DatabaseService.get_last_checked_block() == 0:
-        print("Setting up initial balances for fresh database")
+        logger.info("Setting up initial balances for fresh database")
         
-        for address, balance in INITIAL_BALANCES.items():
-            DatabaseService.set_balance(address, balance)
-            print(f"Set initial balance for {address.hex()}: {balance}")
-        print("Initial balances setup completed")
+        DatabaseService.set_balances_bulk(INITIAL_BALANCES.items())
+        DatabaseService.flush()
+        logger.info("Initial balances setup completed")
 
 # Start the API server in a background task
 def start_api_server():
-    global flask_thread
-    
     def run_flask():
+        global api_server
         try:
-            print(f"Starting Flask API server on port {PORT}")
-            
-            # Disable Flask request logging
-            import logging
-            logging.getLogger('werkzeug').setLevel(logging.ERROR)
+            logger.info("Starting Flask API server on port %s", PORT)
             
-            api_app.run(host='0.0.0.0', port=PORT, debug=False, use_reloader=False)
+            # Bind before signalling readiness, then serve on this thread
+            if waitress_create_server is not None:
+                server = waitress_create_server(api_app, host='0.0.0.0', port=PORT, threads=API_THREADS,
+                                                connection_limit=API_CONNECTION_LIMIT)
+                api_server = server
+                api_server_ready.set()
+                server.run()
+            else:
+                server = make_server('0.0.0.0', PORT, api_app, threaded=True)
+                api_server = server
+                api_server_ready.set()
+                server.serve_forever()
         except Exception as e:
-            print(f"Flask server error: {e}")
+            logger.error("Flask server error: %s", e)
+        finally:
+            api_server_ready.set()
     
     flask_thread = threading.Thread(target=run_flask, daemon=True)
     flask_thread.start()
     
-    time.sleep(2)
-    print(f"Flask API server started on http://0.0.0.0:{PORT}")
+    api_server_ready.wait(timeout=API_STARTUP_TIMEOUT)
+    if api_server is not None:
+        logger.info("Flask API server started on http://0.0.0.0:%s", PORT)
+    else:
+        logger.warning("Flask API server not reachable on port %s", PORT)
+
+# Requests a clean shutdown on SIGINT/SIGTERM so exit hooks flush and close the database
+def install_signal_handlers():
+    for sig in (signal.SIGINT, signal.SIGTERM):
+        signal.signal(sig, lambda signum, frame: shutdown_event.set())
 
 # Application entry point for synchronizing VIDA transactions
 # with the local Merkle-backed database.
 def main():
-    print("Starting PWR VIDA Transaction Synchronizer...")
+    configure_logging()
+    logger.info("Starting PWR VIDA Transaction Synchronizer...")
     
     initialize_peers()
     start_api_server()
@@ -74,9 +130,14 @@ def main():
     last_block = DatabaseService.get_last_checked_block()
     from_block = last_block if last_block > 0 else START_BLOCK
     
-    print(f"Starting synchronization from block {from_block}")
+    logger.info("Starting synchronization from block %s", from_block)
     
+    install_signal_handlers()
     subscribe_and_sync(from_block)
+    
+    shutdown_event.wait()
+    logger.info("Shutting down...")
+    stop_sync()
 
 if __name__ == "__main__":
     main()